@@ -4,358 +4,576 @@
 """Command line wrapper around pybricksdev library."""
 
 import argparse
-import asyncio
-import logging
+import functools
+import os
 import sys
-import validators
 
-from abc import ABC, abstractmethod
+from collections.abc import Coroutine
 from os import path
-
-import argcomplete
-from argcomplete.completers import FilesCompleter
+from typing import Optional, Tuple
 
 from .. import __name__ as MODULE_NAME, __version__ as MODULE_VERSION
 from ..ble.lwp3 import LWP3_BOOTLOADER_SERVICE_UUID
 from ..ble.lwp3.bytecodes import HubKind
 
 
-PROG_NAME = (
-    f"{path.basename(sys.executable)} -m {MODULE_NAME}"
-    if sys.argv[0].endswith("__main__.py")
-    else path.basename(sys.argv[0])
-)
+@functools.lru_cache(maxsize=1)
+def _prog_name() -> str:
+    """Gets the program name to show in the command line help."""
+    if sys.argv[0].endswith("__main__.py"):
+        return f"{path.basename(sys.executable)} -m {MODULE_NAME}"
 
+    return path.basename(sys.argv[0])
 
-class Tool(ABC):
-    """Common base class for tool implementations."""
 
-    @abstractmethod
-    def add_parser(self, subparsers: argparse._SubParsersAction):
-        """
-        Overriding methods must at least do the following::
+def _files_completer(*allowednames: str):
+    """Creates a file name completer that only imports argcomplete when used
+    during tab completion."""
 
-            parser = subparsers.add_parser('tool', ...)
-            parser.tool = self
+    def completer(**kwargs):
+        from argcomplete.completers import FilesCompleter
 
-        Then additional arguments can be added using the ``parser`` object.
-        """
-        pass
+        return FilesCompleter(allowednames=allowednames)(**kwargs)
 
-    @abstractmethod
-    async def run(self, args: argparse.Namespace):
-        """
-        Overriding methods should provide an implementation to run the tool.
-        """
-        pass
+    return completer
 
 
 def _parse_script_arg(script_arg):
     """Save user script argument to a file if it is a Python one-liner."""
-    from ..compile import save_script
+    import glob
+    import hashlib
 
-    if not path.exists(script_arg):
-        return save_script(script_arg)
-    return script_arg
+    from ..compile import BUILD_DIR, save_script
 
+    if path.exists(script_arg):
+        return script_arg
 
-class Compile(Tool):
-    def add_parser(self, subparsers: argparse._SubParsersAction):
-        parser = subparsers.add_parser(
-            "compile",
-            help="compile a Pybricks program without running it",
-        )
-        parser.tool = self
-        # The argument is a filename or a Python one-liner.
-        parser.add_argument(
-            "script",
-            metavar="<script>",
-            help="path to a MicroPython script or inline script",
-        )
-        parser.add_argument(
-            "-i",
-            "--inline-imports",
-            dest="inline",
-            help="Flatten source into one file before compiling",
-            action="store_true",
-        )
-        parser.add_argument(
-            "--import-path",
-            dest="importbase",
-            help="Additional base dir for inlined imports. Ignored unless --inline-imports is True",
-            required=False,
-            default=None,
-        )
+    # One-liners are saved to a file named after their hash, so a file saved
+    # by a previous run with the same script can be reused.
+    digest = hashlib.sha1(script_arg.encode()).hexdigest()[:16]
+    py_name = f"_tmp_{digest}.py"
+    py_path = path.join(BUILD_DIR, py_name)
 
-    async def run(self, args: argparse.Namespace):
-        from ..compile import compile_file, print_mpy
+    if path.exists(py_path):
+        return py_path
 
-        script_path = _parse_script_arg(args.script)
+    # Remove files from other one-liners so the build directory doesn't grow.
+    for old_path in glob.glob(path.join(BUILD_DIR, "_tmp_*")):
+        try:
+            os.remove(old_path)
+        except FileNotFoundError:
+            pass
 
-        if args.inline:
-            from ..inline import flatten
+    return save_script(script_arg, py_name)
 
-            script_path = flatten(script_path, args.importbase)
 
-        # Compile the script and print the result
-        mpy = await compile_file(script_path)
-        print_mpy(mpy)
+def _compile_add(subparsers: argparse._SubParsersAction):
+    parser = subparsers.add_parser(
+        "compile",
+        help="compile a Pybricks program without running it",
+    )
+    # The argument is a filename or a Python one-liner.
+    parser.add_argument(
+        "script",
+        metavar="<script>",
+        help="path to a MicroPython script or inline script",
+    )
+    parser.add_argument(
+        "-i",
+        "--inline-imports",
+        dest="inline",
+        help="Flatten source into one file before compiling",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--import-path",
+        dest="importbase",
+        help="Additional base dir for inlined imports. Ignored unless --inline-imports is True",
+        required=False,
+        default=None,
+    )
 
 
-class Run(Tool):
-    def add_parser(self, subparsers: argparse._SubParsersAction):
-        parser = subparsers.add_parser(
-            "run",
-            help="run a Pybricks program",
-        )
-        parser.tool = self
-        parser.add_argument(
-            "conntype",
-            metavar="<connection type>",
-            help="connection type: %(choices)s",
-            choices=["ble", "usb", "ssh"],
-        )
-        parser.add_argument(
-            "script",
-            metavar="<script>",
-            help="path to a MicroPython script or inline script",
-        )
-        parser.add_argument(
-            "--name",
-            metavar="<name>",
-            required=False,
-            help="hostname or IP address for SSH connection; "
-            "Bluetooth device name or Bluetooth address for BLE connection; "
-            "serial port name for USB connection",
-        )
-        parser.add_argument(
-            "--wait",
-            help="Await program completion (True) or disconnect immediately (False)",
-            required=False,
-            default="True",
-            choices=["True", "False"],
-        )
-        parser.add_argument(
-            "-i",
-            "--inline-imports",
-            dest="inline",
-            help="Flatten source into one file before downloading",
-            action="store_true",
-        )
-        parser.add_argument(
-            "--import-path",
-            dest="importbase",
-            help="Additional base dir for inlined imports. Ignored unless --inline-imports is True",
-            required=False,
-            default=None,
-        )
+MPY_CACHE_SIZE = 100
+"""Maximum number of compiled scripts kept in the cache."""
 
-    async def run(self, args: argparse.Namespace):
-        from ..ble import find_device
-        from ..connections import (
-            PybricksHub,
-            EV3Connection,
-            USBPUPConnection,
-            USBRPCConnection,
-        )
 
-        # Convert script argument to valid path
-        script_path = _parse_script_arg(args.script)
+def _store_cached_mpy(cache_path, mpy: bytes) -> None:
+    """Saves a compiled script in the cache, if possible, and removes the least
+    recently used scripts if there are more than :data:`MPY_CACHE_SIZE`."""
+    import tempfile
+
+    tmp_path = None
 
-        if args.inline:
-            from ..inline import flatten
+    try:
+        # Write to a temporary file first so that other processes never see
+        # a partially written cache file.
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=cache_path.parent, delete=False) as f:
+            tmp_path = f.name
+            f.write(mpy)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        # The cache is only an optimization, so compiling must still work if
+        # the cache directory is not writable.
+        if tmp_path is not None:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        return
 
-            script_path = flatten(script_path, args.importbase)
+    cached = []
 
-        # Pick the right connection
-        if args.conntype == "ssh":
-            # So it's an ev3dev
-            if args.name is None:
-                print("--name is required for SSH connections", file=sys.stderr)
-                exit(1)
+    for entry in os.scandir(cache_path.parent):
+        try:
+            if entry.name.endswith(".mpy"):
+                cached.append((entry.stat().st_mtime, entry.path))
+        except OSError:
+            pass
 
-            if not validators.ip_address.ipv4(args.name):
-                raise ValueError("Device must be IP address.")
+    cached.sort(reverse=True)
 
-            hub = EV3Connection()
-            device_or_address = args.name
-        elif args.conntype == "ble":
-            # It is a Pybricks Hub with BLE. Device name or address is given.
-            hub = PybricksHub()
-            device_or_address = await find_device(args.name)
-        elif args.conntype == "usb" and args.name == "lego":
-            # It's LEGO stock firmware Hub with USB.
-            hub = USBRPCConnection()
-            device_or_address = "LEGO Technic Large Hub in FS Mode"
-        elif args.conntype == "usb":
-            if args.name is None:
-                print("--name is required for USB connections", file=sys.stderr)
-                exit(1)
-
-            # It's a Pybricks Hub with USB. Port name is given.
-            hub = USBPUPConnection()
-            device_or_address = args.name
-        else:
-            raise ValueError(f"Unknown connection type: {args.conntype}")
-
-        # Connect to the address and run the script
-        await hub.connect(device_or_address)
+    for _, old_path in cached[MPY_CACHE_SIZE:]:
         try:
-            await hub.run(script_path, args.wait == "True")
-        finally:
-            await hub.disconnect()
+            os.remove(old_path)
+        except OSError:
+            pass
 
 
-class Flash(Tool):
-    def add_parser(self, subparsers: argparse._SubParsersAction):
-        parser = subparsers.add_parser(
-            "flash", help="flash firmware on a LEGO Powered Up device"
-        )
-        parser.tool = self
-        parser.add_argument(
-            "firmware",
-            metavar="<firmware-file>",
-            type=argparse.FileType(mode="rb"),
-            help="the firmware .zip file",
-        ).completer = FilesCompleter(allowednames=(".zip",))
-
-    async def run(self, args: argparse.Namespace):
-        from ..flash import create_firmware
-
-        print("Creating firmware")
-        firmware, metadata = await create_firmware(args.firmware)
-
-        if metadata["device-id"] == HubKind.PRIME:
-            from ..dfu import flash_dfu
-
-            flash_dfu(firmware, metadata)
-        else:
-            from ..ble import find_device
-            from ..flash import BootloaderConnection
-
-            device = await find_device(service=LWP3_BOOTLOADER_SERVICE_UUID)
-            print("Found:", device)
-            updater = BootloaderConnection()
-            await updater.connect(device)
-            print("Erasing flash and starting update")
-            await updater.flash(firmware, metadata)
-
-
-class DFUBackup(Tool):
-    def add_parser(self, subparsers: argparse._SubParsersAction):
-        parser = subparsers.add_parser("backup", help="backup firmware using DFU")
-        parser.tool = self
-        parser.add_argument(
-            "firmware",
-            metavar="<firmware-file>",
-            type=argparse.FileType(mode="wb"),
-            help="the firmware .bin file",
-        ).completer = FilesCompleter(allowednames=(".bin",))
-
-    async def run(self, args: argparse.Namespace):
-        from ..dfu import backup_dfu
-
-        backup_dfu(args.firmware)
-
-
-class DFURestore(Tool):
-    def add_parser(self, subparsers: argparse._SubParsersAction):
-        parser = subparsers.add_parser(
-            "restore",
-            help="restore firmware using DFU",
-        )
-        parser.tool = self
-        parser.add_argument(
-            "firmware",
-            metavar="<firmware-file>",
-            type=argparse.FileType(mode="rb"),
-            help="the firmware .bin file",
-        ).completer = FilesCompleter(allowednames=(".bin",))
+async def _compile_run(args: argparse.Namespace):
+    import hashlib
+    from importlib.metadata import version
+    from pathlib import Path
 
-    async def run(self, args: argparse.Namespace):
-        from ..dfu import restore_dfu
+    from appdirs import user_cache_dir
 
-        restore_dfu(args.firmware)
+    from ..compile import compile_file, print_mpy
 
+    script_path = _parse_script_arg(args.script)
 
-class DFU(Tool):
-    def add_parser(self, subparsers: argparse._SubParsersAction):
-        self.parser = subparsers.add_parser(
-            "dfu",
-            help="use DFU to backup or restore firmware",
-        )
-        self.parser.tool = self
-        self.subparsers = self.parser.add_subparsers(
-            metavar="<action>", dest="action", help="the action to perform"
-        )
+    if args.inline:
+        from ..inline import flatten
 
-        for tool in DFUBackup(), DFURestore():
-            tool.add_parser(self.subparsers)
+        script_path = flatten(script_path, args.importbase)
 
-    def run(self, args: argparse.Namespace):
-        if args.action not in self.subparsers.choices:
-            self.parser.error(
-                f'Missing name of action: {"|".join(self.subparsers.choices.keys())}'
-            )
+    compile_args = ["-mno-unicode"]
 
-        return self.subparsers.choices[args.action].tool.run(args)
+    # The compiled script only depends on the source, the file name that is
+    # stored in the .mpy file and the compiler, so it can be reused if the
+    # same script has been compiled before.
+    with open(script_path, "rb") as f:
+        source = f.read()
 
+    # None of the key fields can contain a null character, so null separators
+    # keep the key and the source apart.
+    key = [script_path, *compile_args, MODULE_VERSION, version("mpy-cross")]
+    digest = hashlib.sha256("\0".join(key).encode() + b"\0" + source).hexdigest()
+    cache_path = Path(user_cache_dir(MODULE_NAME), "mpy", f"{digest}.mpy")
 
-class LWP3Repl(Tool):
-    def add_parser(self, subparsers: argparse._SubParsersAction):
-        parser = subparsers.add_parser(
-            "repl",
-            help="interactive REPL for sending and receiving LWP3 messages",
-        )
-        parser.tool = self
+    if cache_path.exists():
+        # Mark the script as recently used so it is kept when pruning.
+        try:
+            cache_path.touch()
+        except OSError:
+            pass
 
-    def run(self, args: argparse.Namespace):
-        from .lwp3.repl import setup_repl_logging, repl
+        print_mpy(cache_path.read_bytes())
+        return
 
-        setup_repl_logging()
-        return repl()
+    # Compile the script and print the result
+    mpy = await compile_file(script_path, compile_args)
+    _store_cached_mpy(cache_path, mpy)
+    print_mpy(mpy)
 
 
-class LWP3(Tool):
-    def add_parser(self, subparsers: argparse._SubParsersAction):
-        self.parser = subparsers.add_parser(
-            "lwp3", help="interact with devices using LWP3"
-        )
-        self.parser.tool = self
-        self.subparsers = self.parser.add_subparsers(
-            metavar="<lwp3-tool>", dest="lwp3_tool", help="the tool to run"
-        )
+def _run_add(subparsers: argparse._SubParsersAction):
+    parser = subparsers.add_parser(
+        "run",
+        help="run a Pybricks program",
+    )
+    parser.add_argument(
+        "conntype",
+        metavar="<connection type>",
+        help="connection type: %(choices)s",
+        choices=["ble", "usb", "ssh"],
+    )
+    parser.add_argument(
+        "script",
+        metavar="<script>",
+        help="path to a MicroPython script or inline script",
+    )
+    parser.add_argument(
+        "--name",
+        metavar="<name>",
+        required=False,
+        help="hostname or IP address for SSH connection; "
+        "Bluetooth device name or Bluetooth address for BLE connection; "
+        "serial port name for USB connection",
+    )
+    parser.add_argument(
+        "--wait",
+        help="Await program completion (True) or disconnect immediately (False)",
+        required=False,
+        default="True",
+        choices=["True", "False"],
+    )
+    parser.add_argument(
+        "-i",
+        "--inline-imports",
+        dest="inline",
+        help="Flatten source into one file before downloading",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--import-path",
+        dest="importbase",
+        help="Additional base dir for inlined imports. Ignored unless --inline-imports is True",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--no-ble-cache",
+        dest="ble_cache",
+        help="Scan for the Bluetooth device even if it was found by a previous run",
+        action="store_false",
+    )
+
+
+BLE_CACHE_MAX_AGE = 24 * 60 * 60
+"""How long a cached Bluetooth address is used, in seconds."""
+
 
-        for tool in (LWP3Repl(),):
-            tool.add_parser(self.subparsers)
+def _ble_cache_path():
+    """Gets the path of the file with cached Bluetooth addresses."""
+    from pathlib import Path
+
+    from appdirs import user_cache_dir
+
+    return Path(user_cache_dir(MODULE_NAME), "ble_addr.json")
+
+
+def _read_ble_cache() -> dict:
+    """Reads the mapping of Bluetooth device names to cached addresses."""
+    import json
+
+    try:
+        with open(_ble_cache_path()) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    return cache if isinstance(cache, dict) else {}
+
+
+def _get_cached_ble_address(name: str) -> Optional[str]:
+    """Gets the address of a device found by a previous run, if it was found
+    recently enough."""
+    import time
+
+    entry = _read_ble_cache().get(name)
+
+    try:
+        if time.time() - entry["last_seen"] < BLE_CACHE_MAX_AGE:
+            address = entry["address"]
+            return address if isinstance(address, str) else None
+    except (TypeError, KeyError):
+        pass
 
-    def run(self, args: argparse.Namespace):
-        if args.lwp3_tool not in self.subparsers.choices:
-            self.parser.error(
-                f'Missing name of tool: {"|".join(self.subparsers.choices.keys())}'
+    return None
+
+
+def _set_cached_ble_address(name: str, address: Optional[str]) -> None:
+    """Saves the address of a device or removes it if ``address`` is ``None``."""
+    import json
+    import time
+
+    cache = _read_ble_cache()
+
+    if address is None:
+        cache.pop(name, None)
+    else:
+        cache[name] = {"address": address, "last_seen": time.time()}
+
+    cache_path = _ble_cache_path()
+
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+
+        with open(cache_path, "w") as f:
+            json.dump(cache, f)
+    except OSError as e:
+        # The cache is only an optimization, so it must not break a run.
+        import logging
+
+        logging.getLogger(__name__).warning(f"Failed to save {cache_path}: {e}")
+
+
+async def _run_run(args: argparse.Namespace):
+    import ipaddress
+
+    from bleak.exc import BleakError
+
+    from ..ble import find_device
+    from ..connections import (
+        PybricksHub,
+        EV3Connection,
+        USBPUPConnection,
+        USBRPCConnection,
+    )
+
+    # Convert script argument to valid path
+    script_path = _parse_script_arg(args.script)
+
+    if args.inline:
+        from ..inline import flatten
+
+        script_path = flatten(script_path, args.importbase)
+
+    hub_connected = False
+
+    # Pick the right connection
+    if args.conntype == "ssh":
+        # So it's an ev3dev
+        if args.name is None:
+            print("--name is required for SSH connections", file=sys.stderr)
+            exit(1)
+
+        try:
+            ipaddress.IPv4Address(args.name)
+        except ValueError:
+            raise ValueError("Device must be IP address.") from None
+
+        hub = EV3Connection()
+        device_or_address = args.name
+    elif args.conntype == "ble":
+        # It is a Pybricks Hub with BLE. Device name or address is given.
+        hub = PybricksHub()
+        device_or_address = None
+
+        # Skip scanning if the device was found by a previous run.
+        if args.name is not None and args.ble_cache:
+            device_or_address = _get_cached_ble_address(args.name)
+
+        if device_or_address is not None:
+            try:
+                await hub.connect(device_or_address)
+            except BleakError:
+                # The device may have a different address now. Use a new hub
+                # object so nothing is left over from the failed connection.
+                _set_cached_ble_address(args.name, None)
+                hub = PybricksHub()
+                device_or_address = None
+            else:
+                hub_connected = True
+
+        if device_or_address is None:
+            device_or_address = await find_device(args.name)
+    elif args.conntype == "usb" and args.name == "lego":
+        # It's LEGO stock firmware Hub with USB.
+        hub = USBRPCConnection()
+        device_or_address = "LEGO Technic Large Hub in FS Mode"
+    elif args.conntype == "usb":
+        if args.name is None:
+            print("--name is required for USB connections", file=sys.stderr)
+            exit(1)
+
+        # It's a Pybricks Hub with USB. Port name is given.
+        hub = USBPUPConnection()
+        device_or_address = args.name
+    else:
+        raise ValueError(f"Unknown connection type: {args.conntype}")
+
+    # Connect to the address and run the script
+    if not hub_connected:
+        await hub.connect(device_or_address)
+
+    try:
+        if args.conntype == "ble" and args.name is not None:
+            _set_cached_ble_address(
+                args.name, getattr(device_or_address, "address", device_or_address)
             )
 
-        return self.subparsers.choices[args.lwp3_tool].tool.run(args)
+        await hub.run(script_path, args.wait == "True")
+    finally:
+        await hub.disconnect()
 
 
-class Udev(Tool):
-    def add_parser(self, subparsers: argparse._SubParsersAction):
-        parser = subparsers.add_parser("udev", help="print udev rules to stdout")
-        parser.tool = self
+def _flash_add(subparsers: argparse._SubParsersAction):
+    parser = subparsers.add_parser(
+        "flash", help="flash firmware on a LEGO Powered Up device"
+    )
+    parser.add_argument(
+        "firmware",
+        metavar="<firmware-file>",
+        type=argparse.FileType(mode="rb"),
+        help="the firmware .zip file",
+    ).completer = _files_completer(".zip")
 
-    async def run(self, args: argparse.Namespace):
-        from importlib.resources import read_text
-        from .. import resources
 
-        print(read_text(resources, resources.UDEV_RULES))
+async def _flash_run(args: argparse.Namespace):
+    from ..flash import create_firmware
 
+    print("Creating firmware")
+    firmware, metadata = await create_firmware(args.firmware)
 
-def main():
-    """Runs ``pybricksdev`` command line interface."""
+    if metadata["device-id"] == HubKind.PRIME:
+        from ..dfu import flash_dfu
+
+        flash_dfu(firmware, metadata)
+    else:
+        from ..ble import find_device
+        from ..flash import BootloaderConnection
+
+        device = await find_device(service=LWP3_BOOTLOADER_SERVICE_UUID)
+        print("Found:", device)
+        updater = BootloaderConnection()
+        await updater.connect(device)
+        print("Erasing flash and starting update")
+        await updater.flash(firmware, metadata)
+
+
+def _dfu_backup_add(subparsers: argparse._SubParsersAction):
+    parser = subparsers.add_parser("backup", help="backup firmware using DFU")
+    parser.add_argument(
+        "firmware",
+        metavar="<firmware-file>",
+        type=argparse.FileType(mode="wb"),
+        help="the firmware .bin file",
+    ).completer = _files_completer(".bin")
+
+
+def _dfu_backup_run(args: argparse.Namespace):
+    from ..dfu import backup_dfu
+
+    backup_dfu(args.firmware)
+
+
+def _dfu_restore_add(subparsers: argparse._SubParsersAction):
+    parser = subparsers.add_parser(
+        "restore",
+        help="restore firmware using DFU",
+    )
+    parser.add_argument(
+        "firmware",
+        metavar="<firmware-file>",
+        type=argparse.FileType(mode="rb"),
+        help="the firmware .bin file",
+    ).completer = _files_completer(".bin")
+
+
+def _dfu_restore_run(args: argparse.Namespace):
+    from ..dfu import restore_dfu
+
+    restore_dfu(args.firmware)
+
+
+DFU_TOOLS = {
+    "backup": (_dfu_backup_add, _dfu_backup_run),
+    "restore": (_dfu_restore_add, _dfu_restore_run),
+}
+"""Mapping of DFU action names to ``(add_parser, run)`` functions."""
+
+
+def _dfu_add(subparsers: argparse._SubParsersAction):
+    parser = subparsers.add_parser(
+        "dfu",
+        help="use DFU to backup or restore firmware",
+    )
+    parser.set_defaults(dfu_parser=parser)
+    dfu_subparsers = parser.add_subparsers(
+        metavar="<action>", dest="action", help="the action to perform"
+    )
+
+    for add_parser, _ in DFU_TOOLS.values():
+        add_parser(dfu_subparsers)
+
+
+def _dfu_run(args: argparse.Namespace):
+    if args.action not in DFU_TOOLS:
+        args.dfu_parser.error(f'Missing name of action: {"|".join(DFU_TOOLS)}')
+
+    return DFU_TOOLS[args.action][1](args)
+
+
+def _lwp3_repl_add(subparsers: argparse._SubParsersAction):
+    subparsers.add_parser(
+        "repl",
+        help="interactive REPL for sending and receiving LWP3 messages",
+    )
+
+
+def _lwp3_repl_run(args: argparse.Namespace):
+    from .lwp3.repl import setup_repl_logging, repl
+
+    setup_repl_logging()
+    return repl()
+
+
+LWP3_TOOLS = {
+    "repl": (_lwp3_repl_add, _lwp3_repl_run),
+}
+"""Mapping of LWP3 tool names to ``(add_parser, run)`` functions."""
+
+
+def _lwp3_add(subparsers: argparse._SubParsersAction):
+    parser = subparsers.add_parser("lwp3", help="interact with devices using LWP3")
+    parser.set_defaults(lwp3_parser=parser)
+    lwp3_subparsers = parser.add_subparsers(
+        metavar="<lwp3-tool>", dest="lwp3_tool", help="the tool to run"
+    )
+
+    for add_parser, _ in LWP3_TOOLS.values():
+        add_parser(lwp3_subparsers)
+
+
+def _lwp3_run(args: argparse.Namespace):
+    if args.lwp3_tool not in LWP3_TOOLS:
+        args.lwp3_parser.error(f'Missing name of tool: {"|".join(LWP3_TOOLS)}')
+
+    return LWP3_TOOLS[args.lwp3_tool][1](args)
+
+
+def _udev_add(subparsers: argparse._SubParsersAction):
+    subparsers.add_parser("udev", help="print udev rules to stdout")
+
+
+@functools.lru_cache(maxsize=1)
+def _udev_rules() -> bytes:
+    """Reads the udev rules resource file."""
+    from importlib.resources import read_binary
+    from .. import resources
+
+    return read_binary(resources, resources.UDEV_RULES)
+
+
+def _udev_run(args: argparse.Namespace):
+    # The rules are written as-is to avoid decoding and encoding them again.
+    sys.stdout.buffer.write(_udev_rules() + b"\n")
+
+
+TOOLS = {
+    "compile": (_compile_add, _compile_run),
+    "run": (_run_add, _run_run),
+    "flash": (_flash_add, _flash_run),
+    "dfu": (_dfu_add, _dfu_run),
+    "lwp3": (_lwp3_add, _lwp3_run),
+    "udev": (_udev_add, _udev_run),
+}
+"""Mapping of command line tool names to ``(add_parser, run)`` functions."""
+
+
+@functools.lru_cache(maxsize=None)
+def _create_parser(tool_names: Tuple[str, ...]):
+    """Creates the command line parser with subparsers for the given tools.
+
+    Parsers are cached, so calling :func:`main` more than once in the same
+    process does not rebuild them.
+    """
 
     # Provide main description and help.
     parser = argparse.ArgumentParser(
-        prog=PROG_NAME,
+        prog=_prog_name(),
         description="Utilities for Pybricks developers.",
         epilog="Run `%(prog)s <tool> --help` for tool-specific arguments.",
     )
@@ -373,18 +591,82 @@ def main():
         help="the tool to use",
     )
 
-    for tool in Compile(), Run(), Flash(), DFU(), LWP3(), Udev():
-        tool.add_parser(subparsers)
+    for tool_name in tool_names:
+        TOOLS[tool_name][0](subparsers)
 
-    argcomplete.autocomplete(parser)
-    args = parser.parse_args()
+    return parser, subparsers
 
-    logging.basicConfig(
-        format="%(asctime)s: %(levelname)s: %(name)s: %(message)s",
-        level=logging.DEBUG if args.debug else logging.WARNING,
-    )
+
+_FAST_ARGS = {
+    ("udev",): {"tool": "udev"},
+    ("lwp3", "repl"): {"tool": "lwp3", "lwp3_tool": "repl"},
+}
+"""Parsed arguments for command lines that don't take any arguments, so they
+can be handled without building a parser."""
+
+
+def _parse_args() -> argparse.Namespace:
+    """Parses the command line arguments."""
+
+    if "_ARGCOMPLETE" not in os.environ:
+        fast_args = _FAST_ARGS.get(tuple(sys.argv[1:]))
+
+        if fast_args is not None:
+            return argparse.Namespace(debug=False, **fast_args)
+
+    # Only build the parser for the requested tool. All parsers are needed
+    # for tab completion, help and error messages.
+    global_args = []
+    tool_name = None
+
+    for arg in sys.argv[1:]:
+        if not arg.startswith("-"):
+            tool_name = arg
+            break
+
+        global_args.append(arg)
+
+    # -h or --help before the tool name prints the help for all tools.
+    wants_help = "-h" in global_args or "--help" in global_args
+
+    if "_ARGCOMPLETE" in os.environ or wants_help or tool_name not in TOOLS:
+        parser, subparsers = _create_parser(tuple(TOOLS))
+    else:
+        parser, subparsers = _create_parser((tool_name,))
+
+    # Only load argcomplete when the shell completion handshake is active.
+    if "_ARGCOMPLETE" in os.environ:
+        import argcomplete
+
+        argcomplete.autocomplete(parser)
+
+    args = parser.parse_args()
 
     if not args.tool:
         parser.error(f'Missing name of tool: {"|".join(subparsers.choices.keys())}')
 
-    asyncio.run(subparsers.choices[args.tool].tool.run(args))
+    return args
+
+
+def main():
+    """Runs ``pybricksdev`` command line interface."""
+
+    args = _parse_args()
+
+    # Warnings are already printed by Python's last resort logging handler,
+    # so logging only needs to be configured for debugging.
+    if args.debug:
+        import logging
+
+        logging.basicConfig(
+            format="%(asctime)s: %(levelname)s: %(name)s: %(message)s",
+            level=logging.DEBUG,
+        )
+
+    result = TOOLS[args.tool][1](args)
+
+    # Only tools that return a coroutine need an event loop.
+    if isinstance(result, Coroutine):
+        import asyncio
+
+        asyncio.run(result)
@@ -108,13 +108,13 @@ async def compile_file(path, compile_args=["-mno-unicode"], mpy_version=None):
         return mpy.read()
 
 
-def save_script(py_string):
+def save_script(py_string, py_name=TMP_PY_SCRIPT):
     """Save a MicroPython one-liner to a file."""
     # Make the build directory.
     make_build_dir()
 
     # Path to temporary file.
-    py_path = os.path.join(BUILD_DIR, TMP_PY_SCRIPT)
+    py_path = os.path.join(BUILD_DIR, py_name)
 
     # Write Python command to a file.
     with open(py_path, "w") as f:
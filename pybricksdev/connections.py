@@ -8,6 +8,7 @@ import logging
 import os
 import random
 import struct
+from typing import Union
 
 import asyncssh
 import semver
@@ -699,18 +700,18 @@ class PybricksHub:
                 if not program_running_now:
                     self.user_program_stopped.set()
 
-    async def connect(self, device: BLEDevice):
+    async def connect(self, device: Union[BLEDevice, str]):
         """Connects to a device that was discovered with :meth:`pybricksdev.ble.find_device`
 
         Args:
-            device: The device to connect to.
+            device: The device to connect to or its Bluetooth address.
 
         Raises:
             BleakError: if connecting failed (or old firmware without Device
                 Information Service)
             RuntimeError: if Pybricks Protocol version is not supported
         """
-        logger.info(f"Connecting to {device.address}")
+        logger.info(f"Connecting to {getattr(device, 'address', device)}")
         self.client = BleakClient(device)
 
         def disconnected_handler(self, _: BleakClient):
@@ -735,7 +736,8 @@ class PybricksHub:
             )
             self.connected = True
         except:  # noqa: E722
-            self.disconnect()
+            # self.connected is not set yet, so disconnect() would do nothing
+            await self.client.disconnect()
             raise
 
     async def disconnect(self):
@@ -0,0 +1,379 @@
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+import appdirs
+import argcomplete
+import pytest
+from bleak.exc import BleakError
+
+import pybricksdev.ble
+import pybricksdev.cli
+import pybricksdev.compile
+import pybricksdev.connections
+from pybricksdev.cli import (
+    BLE_CACHE_MAX_AGE,
+    TOOLS,
+    _compile_run,
+    _create_parser,
+    _get_cached_ble_address,
+    _parse_args,
+    _run_run,
+    _set_cached_ble_address,
+)
+
+
+def test_parse_args_single_tool(monkeypatch):
+    monkeypatch.setattr(sys, "argv", ["pybricksdev", "-d", "compile", "script.py"])
+
+    args = _parse_args()
+
+    assert args.tool == "compile"
+    assert args.script == "script.py"
+    assert args.debug
+
+
+@pytest.mark.parametrize(
+    "argv", [["-h", "compile"], ["-d", "--help", "run"], ["--help", "bogus"]]
+)
+def test_parse_args_help_lists_all_tools(monkeypatch, capsys, argv):
+    monkeypatch.setattr(sys, "argv", ["pybricksdev", *argv])
+
+    with pytest.raises(SystemExit):
+        _parse_args()
+
+    help_text = capsys.readouterr().out
+    for tool_name in TOOLS:
+        assert tool_name in help_text
+
+
+FAST_ARGV = [["udev"], ["lwp3", "repl"]]
+
+
+@pytest.mark.parametrize("argv", FAST_ARGV)
+def test_parse_args_fast_path(monkeypatch, argv):
+    monkeypatch.setattr(sys, "argv", ["pybricksdev", *argv])
+    parser, _ = _create_parser(tuple(TOOLS))
+
+    fast_args = _parse_args()
+    full_args = parser.parse_args(argv)
+
+    for name in "tool", "lwp3_tool", "debug":
+        assert getattr(fast_args, name, None) == getattr(full_args, name, None)
+
+
+@pytest.mark.parametrize("argv", FAST_ARGV)
+def test_parse_args_fast_path_not_used_for_completion(monkeypatch, argv):
+    monkeypatch.setattr(sys, "argv", ["pybricksdev", *argv])
+    monkeypatch.setenv("_ARGCOMPLETE", "1")
+    monkeypatch.setattr(argcomplete, "autocomplete", lambda parser: None)
+
+    created = []
+
+    def create_parser(tool_names):
+        created.append(tool_names)
+        return _create_parser(tool_names)
+
+    monkeypatch.setattr(pybricksdev.cli, "_create_parser", create_parser)
+
+    args = _parse_args()
+
+    assert created == [tuple(TOOLS)]
+    assert args.tool == argv[0]
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    """Points the user cache directory at a temporary directory."""
+    cache_dir = tmp_path / "cache"
+    monkeypatch.setattr(appdirs, "user_cache_dir", lambda name: str(cache_dir))
+    return cache_dir
+
+
+@pytest.fixture
+def compiled(monkeypatch):
+    """Replaces mpy-cross with a fake compiler that records compiled paths."""
+    compiled = []
+
+    async def compile_file(path, compile_args):
+        compiled.append(path)
+        with open(path, "rb") as f:
+            return b"M\x05" + path.encode() + f.read()
+
+    monkeypatch.setattr(pybricksdev.compile, "compile_file", compile_file)
+    return compiled
+
+
+def _compile(script_path):
+    args = argparse.Namespace(script=str(script_path), inline=False, importbase=None)
+    asyncio.run(_compile_run(args))
+
+
+def test_compile_uses_cache(tmp_path, cache_dir, compiled, capsys):
+    script = tmp_path / "script.py"
+    script.write_text("print('hello')\n")
+
+    _compile(script)
+    first = capsys.readouterr().out
+    _compile(script)
+    second = capsys.readouterr().out
+
+    assert compiled == [str(script)]
+    assert second == first
+
+
+def test_compile_cache_depends_on_file_name(tmp_path, cache_dir, compiled, capsys):
+    a = tmp_path / "a.py"
+    b = tmp_path / "b.py"
+    a.write_text("print('hello')\n")
+    b.write_text("print('hello')\n")
+
+    _compile(a)
+    _compile(b)
+
+    assert compiled == [str(a), str(b)]
+
+
+def test_compile_cache_source_change(tmp_path, cache_dir, compiled, capsys):
+    script = tmp_path / "script.py"
+    script.write_text("print('hello')\n")
+    _compile(script)
+    script.write_text("print('world')\n")
+    _compile(script)
+
+    assert compiled == [str(script), str(script)]
+
+
+def test_compile_cache_key_separates_source(tmp_path, monkeypatch, cache_dir, compiled):
+    # the source and the path must not run together in the hashed data
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "foo").write_text("AB")
+    (tmp_path / "Bfoo").write_text("A")
+
+    _compile("foo")
+    _compile("Bfoo")
+
+    assert compiled == ["foo", "Bfoo"]
+
+
+def test_compile_cache_pruned(tmp_path, monkeypatch, cache_dir, compiled, capsys):
+    monkeypatch.setattr(pybricksdev.cli, "MPY_CACHE_SIZE", 2)
+    scripts = []
+
+    for i in range(3):
+        script = tmp_path / f"script{i}.py"
+        script.write_text(f"print({i})\n")
+        scripts.append(script)
+        _compile(script)
+
+        # give each cache entry a distinct modification time
+        for entry in os.scandir(cache_dir / "mpy"):
+            if entry.stat().st_mtime > 1000:
+                os.utime(entry.path, (i + 1, i + 1))
+
+    assert len(os.listdir(cache_dir / "mpy")) == 2
+
+    # the least recently used script was removed from the cache
+    _compile(scripts[2])
+    _compile(scripts[1])
+    _compile(scripts[0])
+
+    assert compiled == [str(s) for s in scripts] + [str(scripts[0])]
+
+
+def test_compile_unwritable_cache(tmp_path, monkeypatch, compiled, capsys):
+    # a file where the cache directory should be makes creating it fail
+    not_a_dir = tmp_path / "cache"
+    not_a_dir.write_text("")
+    monkeypatch.setattr(appdirs, "user_cache_dir", lambda name: str(not_a_dir))
+
+    script = tmp_path / "script.py"
+    script.write_text("print('hello')\n")
+    _compile(script)
+
+    assert compiled == [str(script)]
+    assert "const uint8_t script[]" in capsys.readouterr().out
+    assert not_a_dir.read_text() == ""
+
+
+def test_ble_cache_missing(cache_dir):
+    assert _get_cached_ble_address("hub") is None
+
+
+def test_ble_cache_roundtrip(cache_dir):
+    _set_cached_ble_address("hub", "00:11:22:33:44:55")
+    _set_cached_ble_address("other", "66:77:88:99:AA:BB")
+
+    assert _get_cached_ble_address("hub") == "00:11:22:33:44:55"
+    assert _get_cached_ble_address("other") == "66:77:88:99:AA:BB"
+
+
+def test_ble_cache_remove(cache_dir):
+    _set_cached_ble_address("hub", "00:11:22:33:44:55")
+    _set_cached_ble_address("hub", None)
+
+    assert _get_cached_ble_address("hub") is None
+
+
+def test_ble_cache_expired(cache_dir, monkeypatch):
+    _set_cached_ble_address("hub", "00:11:22:33:44:55")
+    now = time.time()
+
+    monkeypatch.setattr(time, "time", lambda: now + BLE_CACHE_MAX_AGE - 1)
+    assert _get_cached_ble_address("hub") == "00:11:22:33:44:55"
+
+    monkeypatch.setattr(time, "time", lambda: now + BLE_CACHE_MAX_AGE + 1)
+    assert _get_cached_ble_address("hub") is None
+
+
+@pytest.mark.parametrize(
+    "contents",
+    [
+        "not json",
+        "[]",
+        '"hub"',
+        '{"hub": "00:11:22:33:44:55"}',
+        '{"hub": {"address": "00:11:22:33:44:55"}}',
+        '{"hub": {"last_seen": 0}}',
+        '{"hub": {"address": 5, "last_seen": 1e100}}',
+    ],
+)
+def test_ble_cache_corrupt(cache_dir, contents):
+    cache_dir.mkdir()
+    (cache_dir / "ble_addr.json").write_text(contents)
+
+    assert _get_cached_ble_address("hub") is None
+
+    # writing replaces the corrupt file
+    _set_cached_ble_address("hub", "00:11:22:33:44:55")
+    assert _get_cached_ble_address("hub") == "00:11:22:33:44:55"
+
+
+def test_ble_cache_unwritable(tmp_path, monkeypatch, caplog):
+    not_a_dir = tmp_path / "cache"
+    not_a_dir.write_text("")
+    monkeypatch.setattr(appdirs, "user_cache_dir", lambda name: str(not_a_dir))
+
+    with caplog.at_level(logging.WARNING):
+        _set_cached_ble_address("hub", "00:11:22:33:44:55")
+
+    assert "ble_addr.json" in caplog.text
+    assert _get_cached_ble_address("hub") is None
+
+
+def test_no_ble_cache_option():
+    parser, _ = _create_parser(("run",))
+
+    args = parser.parse_args(["run", "ble", "script.py", "--name", "hub"])
+    assert args.ble_cache
+
+    args = parser.parse_args(["run", "ble", "script.py", "--no-ble-cache"])
+    assert not args.ble_cache
+
+
+class FakeDevice:
+    address = "66:77:88:99:AA:BB"
+
+
+@pytest.fixture
+def hubs(monkeypatch):
+    """Replaces PybricksHub and find_device with fakes. A hub can't connect to
+    the address "stale". Returns the list of created hubs."""
+    hubs = []
+
+    class FakeHub:
+        def __init__(self):
+            self.connected_to = None
+            self.disconnected = False
+            hubs.append(self)
+
+        async def connect(self, device):
+            if device == "stale":
+                raise BleakError("device not found")
+            self.connected_to = device
+
+        async def run(self, script_path, wait):
+            assert self.connected_to is not None
+
+        async def disconnect(self):
+            self.disconnected = True
+
+    async def find_device(name):
+        return FakeDevice()
+
+    monkeypatch.setattr(pybricksdev.connections, "PybricksHub", FakeHub)
+    monkeypatch.setattr(pybricksdev.ble, "find_device", find_device)
+    return hubs
+
+
+def _run(script_path, ble_cache=True):
+    args = argparse.Namespace(
+        conntype="ble",
+        script=str(script_path),
+        name="hub",
+        wait="True",
+        inline=False,
+        importbase=None,
+        ble_cache=ble_cache,
+    )
+    asyncio.run(_run_run(args))
+
+
+def test_run_ble_uses_cache(tmp_path, cache_dir, hubs):
+    script = tmp_path / "script.py"
+    script.write_text("print('hello')\n")
+    _set_cached_ble_address("hub", "00:11:22:33:44:55")
+
+    _run(script)
+
+    assert [h.connected_to for h in hubs] == ["00:11:22:33:44:55"]
+    assert hubs[0].disconnected
+
+
+def test_run_ble_saves_address(tmp_path, cache_dir, hubs):
+    script = tmp_path / "script.py"
+    script.write_text("print('hello')\n")
+
+    _run(script)
+
+    assert hubs[0].connected_to is not None
+    assert _get_cached_ble_address("hub") == FakeDevice.address
+
+
+def test_run_ble_stale_cache(tmp_path, cache_dir, hubs):
+    script = tmp_path / "script.py"
+    script.write_text("print('hello')\n")
+    _set_cached_ble_address("hub", "stale")
+
+    _run(script)
+
+    # a new hub is used after the failed connection
+    assert len(hubs) == 2
+    assert hubs[0].connected_to is None
+    assert isinstance(hubs[1].connected_to, FakeDevice)
+    assert _get_cached_ble_address("hub") == FakeDevice.address
+
+
+def test_run_ble_no_cache(tmp_path, cache_dir, hubs):
+    script = tmp_path / "script.py"
+    script.write_text("print('hello')\n")
+    _set_cached_ble_address("hub", "00:11:22:33:44:55")
+
+    _run(script, ble_cache=False)
+
+    assert isinstance(hubs[0].connected_to, FakeDevice)
+
+
+def test_run_ble_unwritable_cache(tmp_path, monkeypatch, hubs):
+    not_a_dir = tmp_path / "cache"
+    not_a_dir.write_text("")
+    monkeypatch.setattr(appdirs, "user_cache_dir", lambda name: str(not_a_dir))
+    script = tmp_path / "script.py"
+    script.write_text("print('hello')\n")
+
+    _run(script)
+
+    assert hubs[0].disconnected